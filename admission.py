@@ -0,0 +1,138 @@
+"""
+Control de admisión de preguntas: límite por sesión y concurrencia global
+"""
+
+import streamlit as st
+import threading
+import time
+from collections import OrderedDict
+from config import (RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE, MAX_CONCURRENT_REQUESTS,
+                    MAX_QUEUED_REQUESTS, QUEUE_TIMEOUT)
+
+# Resultados posibles de una petición de admisión
+ADMITIDA = "admitida"
+LIMITADA = "limitada"  # La sesión ha superado su ritmo de preguntas
+OCUPADO = "ocupado"  # Cola global llena o espera agotada
+
+# A partir de este número de sesiones se descarta el bucket usado hace más tiempo
+MAX_TRACKED_SESSIONS = 1000
+
+class TokenBucket:
+    """Bucket de tokens: permite ráfagas cortas y limita el ritmo sostenido"""
+
+    def __init__(self, capacity, refill_rate):
+        """
+        Args:
+            capacity (int): Tokens máximos (tamaño de la ráfaga)
+            refill_rate (float): Tokens recuperados por segundo
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def consume(self):
+        """
+        Gasta un token si hay disponible
+
+        Returns:
+            bool: True si se ha podido gastar
+        """
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def refund(self):
+        """Devuelve un token gastado en una petición que no se ha atendido"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class AdmissionController:
+    """
+    Decide si una pregunta entra a consultar al LLM
+
+    Compartido por todas las sesiones del proceso de Streamlit. Combina un
+    bucket de tokens por sesión con un semáforo global de llamadas simultáneas
+    y una cola de espera acotada. Los envíos duplicados no se controlan aquí:
+    los evita el botón Enviar de web_app.py, deshabilitado mientras la
+    pregunta está en curso (pregunta_en_curso).
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_queued=MAX_QUEUED_REQUESTS,
+                 queue_timeout=QUEUE_TIMEOUT, burst=RATE_LIMIT_BURST,
+                 per_minute=RATE_LIMIT_PER_MINUTE):
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.burst = burst
+        self.refill_rate = per_minute / 60
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._waiting = 0
+
+    def _bucket(self, session_id):
+        if session_id in self._buckets:
+            self._buckets.move_to_end(session_id)
+        else:
+            if len(self._buckets) >= MAX_TRACKED_SESSIONS:
+                self._buckets.popitem(last=False)
+            self._buckets[session_id] = TokenBucket(self.burst, self.refill_rate)
+        return self._buckets[session_id]
+
+    def acquire(self, session_id):
+        """
+        Solicita turno para consultar al LLM, esperando en cola si hace falta
+
+        Si se admite, hay que llamar a release() al terminar. Las
+        peticiones rechazadas por OCUPADO no gastan ritmo de la sesión.
+
+        Args:
+            session_id (str): ID de la sesión
+
+        Returns:
+            tuple: (resultado, tiempo_espera) con resultado ADMITIDA, LIMITADA
+                   u OCUPADO y el tiempo en cola en segundos
+        """
+        with self._lock:
+            if not self._bucket(session_id).consume():
+                return LIMITADA, 0.0
+
+            # Hueco libre: entra sin pasar por la cola
+            if self._slots.acquire(blocking=False):
+                return ADMITIDA, 0.0
+
+            if self._waiting >= self.max_queued:
+                self._buckets[session_id].refund()
+                return OCUPADO, 0.0
+            self._waiting += 1
+
+        start_time = time.monotonic()
+        admitida = self._slots.acquire(timeout=self.queue_timeout)
+        tiempo_espera = time.monotonic() - start_time
+
+        with self._lock:
+            self._waiting -= 1
+            if not admitida:
+                self._bucket(session_id).refund()
+
+        return (ADMITIDA if admitida else OCUPADO), tiempo_espera
+
+    def release(self):
+        """Libera el turno obtenido con acquire"""
+        self._slots.release()
+
+@st.cache_resource
+def get_admission_controller():
+    """
+    Devuelve el controlador de admisión compartido por todas las sesiones
+
+    Returns:
+        AdmissionController: Controlador del proceso
+    """
+    return AdmissionController()
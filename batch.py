@@ -0,0 +1,412 @@
+"""
+Procesamiento por lotes de preguntas sin la interfaz de Streamlit
+
+Uso:
+    python batch.py preguntas.jsonl respuestas.jsonl [--workers N] [--batch-size N]
+
+Cada línea de entrada es un JSON con las claves:
+    id (opcional), question, mode (opcional, "ciudadano" por defecto),
+    history (opcional, lista de pares [pregunta, respuesta])
+
+Las líneas de entrada mal formadas se ignoran, indicando su número, y
+cuentan como fallidas.
+
+Las respuestas se escriben en cuanto terminan, así que si el proceso se
+interrumpe basta con relanzar el mismo comando para continuar donde se quedó.
+Las preguntas que fallaron se reintentan y, al terminar, el fichero de salida
+se compacta para dejar una sola línea por id (la más reciente).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from chatbot import (PROMPTS, PromptCacheUsage, build_chatbot_components, get_prompt,
+                     canonical_order, format_context, format_chat_history)
+from config import RETRIEVER_K, BATCH_WORKERS, BATCH_SIZE
+
+DEFAULT_MODE = "ciudadano"
+
+def parse_question(item, numero):
+    """
+    Valida una línea de entrada ya decodificada
+
+    Args:
+        item: Objeto JSON de la línea
+        numero (int): Número de línea, id por defecto
+
+    Returns:
+        dict: Pregunta con id, question, mode y history
+
+    Raises:
+        ValueError: Si falta algún campo o tiene un tipo incorrecto
+    """
+    if not isinstance(item, dict):
+        raise ValueError("la línea no es un objeto JSON")
+
+    question = item.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("'question' debe ser un texto no vacío")
+
+    mode = item.get("mode", DEFAULT_MODE)
+    if not isinstance(mode, str):
+        raise ValueError("'mode' debe ser un texto")
+
+    history = item.get("history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(par, list) and len(par) == 2 and all(isinstance(texto, str) for texto in par)
+        for par in history
+    ):
+        raise ValueError("'history' debe ser una lista de pares [pregunta, respuesta]")
+
+    return {
+        "id": str(item.get("id", numero)),
+        "question": question,
+        "mode": mode,
+        "history": history
+    }
+
+def load_questions(path):
+    """
+    Lee las preguntas del fichero JSONL de entrada
+
+    Args:
+        path (str): Ruta del fichero de preguntas
+
+    Returns:
+        tuple: (items, invalidas) con la lista de diccionarios con id, question,
+               mode y history y el número de líneas ignoradas por mal formadas
+    """
+    items = []
+    invalidas = 0
+    with open(path, encoding="utf-8") as f:
+        for numero, linea in enumerate(f, start=1):
+            if not linea.strip():
+                continue
+            try:
+                items.append(parse_question(json.loads(linea), numero))
+            except ValueError as e:  # JSONDecodeError también es ValueError
+                print(f"⚠️ Línea {numero} ignorada: {type(e).__name__}: {e}")
+                invalidas += 1
+    return items, invalidas
+
+def load_completed_ids(path):
+    """
+    Obtiene los ids ya respondidos en una ejecución anterior
+
+    Las líneas con error no cuentan como completadas para que se reintenten.
+
+    Args:
+        path (str): Ruta del fichero de respuestas
+
+    Returns:
+        set: Ids completados correctamente
+    """
+    completados = set()
+    if not os.path.exists(path):
+        return completados
+
+    with open(path, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                resultado = json.loads(linea)
+            except json.JSONDecodeError:
+                continue  # Última línea cortada por una caída
+            if not resultado.get("error"):
+                completados.add(str(resultado["id"]))
+    return completados
+
+def open_output(path):
+    """
+    Abre el fichero de respuestas para añadir resultados
+
+    Si una caída dejó la última línea a medias, se termina con un salto de
+    línea para que los nuevos resultados no queden pegados a ella.
+    """
+    cortada = False
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            cortada = f.read(1) != b"\n"
+
+    output = open(path, "a", encoding="utf-8")
+    if cortada:
+        output.write("\n")
+    return output
+
+def compact_output(path):
+    """
+    Deja una sola línea por id en el fichero de respuestas
+
+    Al reintentar una pregunta fallida su nuevo resultado se añade al final,
+    así que se conserva la última línea de cada id. Las líneas cortadas por
+    una caída se descartan.
+
+    Args:
+        path (str): Ruta del fichero de respuestas
+    """
+    resultados = {}
+    with open(path, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                resultado = json.loads(linea)
+            except json.JSONDecodeError:
+                continue
+            resultados.pop(str(resultado["id"]), None)
+            resultados[str(resultado["id"])] = resultado
+
+    temporal = path + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        for resultado in resultados.values():
+            f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+    os.replace(temporal, path)
+
+def search_batch(db, vectores, k):
+    """
+    Busca en FAISS los fragmentos de todas las preguntas de un lote a la vez
+
+    Args:
+        db: Base de datos vectorial
+        vectores (list): Embeddings de las preguntas
+        k (int): Fragmentos por pregunta
+
+    Returns:
+        list: Lista de documentos recuperados por cada pregunta
+    """
+    matriz = np.asarray(vectores, dtype=np.float32)
+    if getattr(db, "_normalize_L2", False):
+        matriz /= np.linalg.norm(matriz, axis=1, keepdims=True)
+
+    _, indices = db.index.search(matriz, k)
+    return [
+        [db.docstore.search(db.index_to_docstore_id[i]) for i in fila if i != -1]
+        for fila in indices
+    ]
+
+def timed(stats, stage, func, *args, **kwargs):
+    """Ejecuta func y registra su duración en la etapa indicada"""
+    start_time = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats[stage].append(time.perf_counter() - start_time)
+
+def condense_question(llm, item, stats, usage):
+    """
+    Reformula la pregunta como independiente si tiene historial, igual que
+    hace ConversationalRetrievalChain antes de buscar en el vectorstore
+    """
+    if not item["history"]:
+        return item["question"]
+
+    prompt = CONDENSE_QUESTION_PROMPT.format(
+        chat_history=format_chat_history(item["history"]),
+        question=item["question"]
+    )
+    return timed(stats, "condensacion", llm.invoke, prompt, config={"callbacks": [usage]}).content
+
+def generate_answer(llm, item, standalone, docs, stats, usage):
+    """
+    Genera la respuesta de una pregunta con su contexto ya recuperado
+
+    Returns:
+        dict: Resultado listo para escribir en el fichero de salida
+    """
+    prompt = get_prompt(item["mode"]).format(
+        context=format_context(docs),
+        chat_history=format_chat_history(item["history"]),
+        question=standalone
+    )
+    respuesta = timed(stats, "generacion", llm.invoke, prompt, config={"callbacks": [usage]})
+
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "mode": item["mode"],
+        "answer": respuesta.content,
+        "sources": [doc.page_content for doc in docs]
+    }
+
+def error_result(item, error):
+    """Construye el resultado de una pregunta que ha fallado"""
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "mode": item["mode"],
+        "error": f"{type(error).__name__}: {error}"
+    }
+
+def process_questions(items, db, llm, output, workers, batch_size, stats, usage):
+    """
+    Responde las preguntas por lotes y escribe cada resultado al terminar
+
+    Los embeddings y la búsqueda en FAISS se hacen en una sola llamada por
+    lote y las llamadas al LLM se reparten en un pool de hilos acotado, de
+    modo que el siguiente lote se prepara mientras se generan las respuestas
+    del anterior.
+
+    Args:
+        items (list): Preguntas pendientes
+        db: Base de datos vectorial
+        llm: Modelo de lenguaje
+        output: Fichero de salida abierto en modo append
+        workers (int): Número máximo de llamadas simultáneas al LLM
+        batch_size (int): Preguntas por lote de embeddings
+        stats (dict): Duraciones por etapa
+        usage (PromptCacheUsage): Acumulador de tokens de entrada y en caché
+
+    Returns:
+        tuple: (respondidas, fallidas)
+    """
+    respondidas = fallidas = 0
+    pendientes = {}
+
+    def escribir(resultado):
+        output.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+        output.flush()
+
+    def recoger(futures):
+        nonlocal respondidas, fallidas
+        for future in futures:
+            item = pendientes.pop(future)
+            try:
+                escribir(future.result())
+                respondidas += 1
+            except Exception as e:
+                escribir(error_result(item, e))
+                fallidas += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for inicio in range(0, len(items), batch_size):
+            lote = []
+            for item in items[inicio:inicio + batch_size]:
+                if item["mode"] in PROMPTS:
+                    lote.append(item)
+                else:
+                    escribir(error_result(item, ValueError(f"Modo desconocido: {item['mode']}")))
+                    fallidas += 1
+            if not lote:
+                continue
+
+            # 1. Reformular las preguntas con historial (en paralelo)
+            futures = [executor.submit(condense_question, llm, item, stats, usage)
+                       for item in lote]
+            validos, preguntas = [], []
+            for item, future in zip(lote, futures):
+                try:
+                    preguntas.append(future.result())
+                    validos.append(item)
+                except Exception as e:
+                    escribir(error_result(item, e))
+                    fallidas += 1
+            if not validos:
+                continue
+
+            # 2. Embeddings del lote en una sola llamada
+            try:
+                vectores = timed(stats, "embeddings", db.embeddings.embed_documents, preguntas)
+            except Exception as e:
+                for item in validos:
+                    escribir(error_result(item, e))
+                    fallidas += 1
+                continue
+
+            # 3. Recuperación del lote en una sola búsqueda
+            try:
+                resultados = timed(stats, "recuperacion", search_batch, db, vectores, RETRIEVER_K)
+            except Exception as e:
+                for item in validos:
+                    escribir(error_result(item, e))
+                    fallidas += 1
+                continue
+
+            # 4. Envío de la generación al pool
+            for item, pregunta, docs in zip(validos, preguntas, resultados):
+                future = executor.submit(generate_answer, llm, item, pregunta, canonical_order(docs), stats, usage)
+                pendientes[future] = item
+
+            # Limitar las generaciones en vuelo antes de preparar otro lote
+            while len(pendientes) > workers * 2:
+                hechas, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                recoger(hechas)
+            recoger([future for future in list(pendientes) if future.done()])
+
+        hechas, _ = wait(pendientes)
+        recoger(hechas)
+
+    return respondidas, fallidas
+
+def print_report(stats, usage, respondidas, fallidas, tiempo_total):
+    """Muestra el rendimiento global, el uso de la caché y la latencia de cada etapa"""
+    print(f"\n📊 Preguntas respondidas: {respondidas} | Fallidas: {fallidas}")
+    print(f"⏱️ Tiempo total: {tiempo_total:.2f}s")
+    if tiempo_total > 0:
+        print(f"⚡ Rendimiento: {respondidas / tiempo_total:.2f} preguntas/s")
+    print(f"🗄️ Tokens de entrada en caché: {usage.cached_tokens}/{usage.input_tokens} "
+          f"({usage.cached_ratio:.1%})")
+
+    if not any(stats.values()):
+        return
+
+    print(f"\n{'Etapa':<14}{'n':>6}{'media':>10}{'p50':>10}{'p95':>10}{'total':>10}")
+    for etapa, duraciones in stats.items():
+        if not duraciones:
+            continue
+        ordenadas = sorted(duraciones)
+        p95 = ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))]
+        print(f"{etapa:<14}{len(ordenadas):>6}"
+              f"{statistics.mean(ordenadas):>9.3f}s"
+              f"{statistics.median(ordenadas):>9.3f}s"
+              f"{p95:>9.3f}s"
+              f"{sum(ordenadas):>9.2f}s")
+
+def positive_int(valor):
+    """Tipo de argparse para enteros mayores que cero"""
+    numero = int(valor)
+    if numero < 1:
+        raise argparse.ArgumentTypeError(f"debe ser al menos 1: {valor}")
+    return numero
+
+def main():
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="Responde preguntas de un fichero JSONL por lotes")
+    parser.add_argument("entrada", help="Fichero JSONL con las preguntas")
+    parser.add_argument("salida", help="Fichero JSONL donde se escriben las respuestas")
+    parser.add_argument("--workers", type=positive_int, default=BATCH_WORKERS,
+                        help=f"Llamadas simultáneas al LLM (por defecto {BATCH_WORKERS})")
+    parser.add_argument("--batch-size", type=positive_int, default=BATCH_SIZE,
+                        help=f"Preguntas por lote de embeddings (por defecto {BATCH_SIZE})")
+    args = parser.parse_args()
+
+    items, invalidas = load_questions(args.entrada)
+    completados = load_completed_ids(args.salida)
+    pendientes = [item for item in items if item["id"] not in completados]
+    print(f"📥 {len(items)} preguntas, {len(completados)} ya respondidas, {len(pendientes)} pendientes"
+          f", {invalidas} líneas ignoradas")
+    if not pendientes:
+        return
+
+    try:
+        db, llm = build_chatbot_components()
+    except Exception as e:
+        print(f"❌ No se pudo cargar el chatbot: {type(e).__name__}: {e}")
+        print("   Verifica que existe la carpeta 'vectorstore/' y tu API key.")
+        sys.exit(1)
+
+    stats = {"condensacion": [], "embeddings": [], "recuperacion": [], "generacion": []}
+    usage = PromptCacheUsage()
+    start_time = time.perf_counter()
+    with open_output(args.salida) as output:
+        respondidas, fallidas = process_questions(
+            pendientes, db, llm, output, args.workers, args.batch_size, stats, usage
+        )
+    compact_output(args.salida)
+    print_report(stats, usage, respondidas, fallidas + invalidas, time.perf_counter() - start_time)
+
+if __name__ == "__main__":
+    main()
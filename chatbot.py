@@ -4,16 +4,20 @@ Lógica del chatbot, prompts y configuración de LangChain
 
 import streamlit as st
 import os
+import threading
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
 from config import MODEL_NAME, MODEL_TEMPERATURE, RETRIEVER_K
 
-# Prompts para diferentes modos
-PROMPTS = {
+# Parte estática de cada modo (personalidad e instrucciones). Va al principio
+# del prompt y no debe cambiar entre llamadas para aprovechar la caché de
+# prompts del proveedor, que solo reutiliza prefijos idénticos.
+PROMPT_PREFIXES = {
     "ciudadano": """
 Eres un asistente constitucional amigable que ayuda a ciudadanos españoles a entender sus derechos y deberes.
 
@@ -28,17 +32,6 @@ INSTRUCCIONES:
 - Menciona SIEMPRE el artículo específico (ej: "según el artículo 20...")
 - Si no encuentras información, dilo claramente
 - Ofrece ejemplos prácticos cuando sea útil
-
-CONTEXTO DE LA CONSTITUCIÓN:
-{context}
-
-HISTORIAL DE CONVERSACIÓN:
-{chat_history}
-
-PREGUNTA DEL CIUDADANO:
-{question}
-
-RESPUESTA (como experto constitucional amigable):
 """,
 
     "estudiante": """
@@ -56,17 +49,6 @@ INSTRUCCIONES:
 - Explica el contexto histórico cuando sea relevante
 - Relaciona con otros artículos o principios constitucionales
 - Sugiere qué más estudiar sobre el tema
-
-CONTEXTO DE LA CONSTITUCIÓN:
-{context}
-
-HISTORIAL DE CONVERSACIÓN:
-{chat_history}
-
-PREGUNTA DEL ESTUDIANTE:
-{question}
-
-RESPUESTA (como profesor de Derecho Constitucional):
 """,
 
     "profesional": """
@@ -84,20 +66,164 @@ INSTRUCCIONES:
 - Analiza las implicaciones prácticas
 - Menciona posibles interpretaciones doctrinales
 - Señala conexiones con otras normas del ordenamiento
+"""
+}
+
+# Etiquetas de la pregunta y la respuesta de cada modo
+PROMPT_LABELS = {
+    "ciudadano": ("PREGUNTA DEL CIUDADANO", "como experto constitucional amigable"),
+    "estudiante": ("PREGUNTA DEL ESTUDIANTE", "como profesor de Derecho Constitucional"),
+    "profesional": ("CONSULTA PROFESIONAL", "como jurista constitucionalista")
+}
 
+# Parte variable, siempre detrás del prefijo: contexto, historial y pregunta
+PROMPT_SUFFIX = """
 CONTEXTO DE LA CONSTITUCIÓN:
-{context}
+{{context}}
 
 HISTORIAL DE CONVERSACIÓN:
-{chat_history}
+{{chat_history}}
 
-CONSULTA PROFESIONAL:
-{question}
+{question_label}:
+{{question}}
 
-RESPUESTA (como jurista constitucionalista):
+RESPUESTA ({answer_label}):
 """
+
+# Prompts completos para diferentes modos
+PROMPTS = {
+    mode: prefix + PROMPT_SUFFIX.format(
+        question_label=PROMPT_LABELS[mode][0],
+        answer_label=PROMPT_LABELS[mode][1]
+    )
+    for mode, prefix in PROMPT_PREFIXES.items()
 }
 
+def get_prompt(mode):
+    """
+    Crea el prompt del modo indicado
+    
+    Args:
+        mode (str): Modo seleccionado ("ciudadano", "estudiante", "profesional")
+        
+    Returns:
+        PromptTemplate: Prompt con las variables context, chat_history y question
+    """
+    return PromptTemplate(
+        input_variables=["context", "chat_history", "question"],
+        template=PROMPTS[mode]
+    )
+
+def canonical_order(docs):
+    """
+    Ordena los fragmentos recuperados de forma estable
+    
+    El retriever los devuelve por similitud, así que el mismo conjunto de
+    artículos llegaría en distinto orden según la pregunta. Ordenarlos por su
+    contenido hace que el contexto, y por tanto el prompt, sea idéntico.
+    
+    Args:
+        docs (list): Documentos recuperados del vectorstore
+        
+    Returns:
+        list: Documentos sin duplicados y en orden canónico
+    """
+    unicos = {doc.page_content: doc for doc in docs}
+    return [unicos[contenido] for contenido in sorted(unicos)]
+
+def format_context(docs):
+    """
+    Une los fragmentos recuperados igual que la cadena conversacional
+    
+    Args:
+        docs (list): Documentos recuperados del vectorstore
+        
+    Returns:
+        str: Contexto listo para el prompt
+    """
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def format_chat_history(history):
+    """
+    Convierte un historial de pares (pregunta, respuesta) en texto
+    
+    Args:
+        history (list): Lista de pares [pregunta, respuesta]
+        
+    Returns:
+        str: Historial con el formato "Human: ... / Assistant: ..."
+    """
+    lineas = []
+    for pregunta, respuesta in history or []:
+        lineas.append(f"Human: {pregunta}\nAssistant: {respuesta}")
+    return "\n".join(lineas)
+
+class CanonicalRetrievalChain(ConversationalRetrievalChain):
+    """ConversationalRetrievalChain que pasa el contexto en orden canónico"""
+    
+    def _get_docs(self, question, inputs, *, run_manager):
+        return canonical_order(super()._get_docs(question, inputs, run_manager=run_manager))
+    
+    async def _aget_docs(self, question, inputs, *, run_manager):
+        return canonical_order(await super()._aget_docs(question, inputs, run_manager=run_manager))
+
+class PromptCacheUsage(BaseCallbackHandler):
+    """
+    Acumula los tokens de entrada de las llamadas al LLM y cuántos de ellos
+    sirvió la caché de prompts del proveedor
+    """
+    
+    def __init__(self):
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+    
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                details = usage.get("input_token_details") or {}
+                with self._lock:
+                    self.input_tokens += usage.get("input_tokens", 0)
+                    self.cached_tokens += details.get("cache_read", 0)
+    
+    @property
+    def cached_ratio(self):
+        """Proporción de tokens de entrada servidos desde caché (0-1)"""
+        if not self.input_tokens:
+            return 0.0
+        return self.cached_tokens / self.input_tokens
+
+def build_chatbot_components():
+    """
+    Crea los componentes base del chatbot (embeddings, vectorstore, LLM)
+    
+    A diferencia de load_chatbot_components no depende de Streamlit y deja
+    pasar la excepción, para usarlo desde la línea de comandos.
+    
+    Returns:
+        tuple: (db, llm)
+    """
+    load_dotenv()
+    
+    # Cargar embeddings
+    embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+    
+    # Cargar vectorstore
+    db = FAISS.load_local("vectorstore/", embeddings, allow_dangerous_deserialization=True)
+    
+    # Crear LLM
+    llm = ChatOpenAI(
+        model=MODEL_NAME,
+        temperature=MODEL_TEMPERATURE,
+        openai_api_key=os.getenv("OPENAI_API_KEY")
+    )
+    
+    return db, llm
+
 @st.cache_resource
 def load_chatbot_components():
     """
@@ -106,24 +232,8 @@ def load_chatbot_components():
     Returns:
         tuple: (db, llm) o (None, None) si hay error
     """
-    load_dotenv()
-    
     try:
-        # Cargar embeddings
-        embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
-        
-        # Cargar vectorstore
-        db = FAISS.load_local("vectorstore/", embeddings, allow_dangerous_deserialization=True)
-        
-        # Crear LLM
-        llm = ChatOpenAI(
-            model=MODEL_NAME,
-            temperature=MODEL_TEMPERATURE,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
-        
-        return db, llm
-        
+        return build_chatbot_components()
     except Exception as e:
         st.error(f"❌ Error cargando componentes del chatbot: {e}")
         return None, None
@@ -138,7 +248,7 @@ def create_conversational_chain(llm, db, mode):
         mode (str): Modo seleccionado ("ciudadano", "estudiante", "profesional")
         
     Returns:
-        ConversationalRetrievalChain: Cadena configurada
+        CanonicalRetrievalChain: Cadena configurada
     """
     # Crear memoria para la conversación
     memory = ConversationBufferMemory(
@@ -148,13 +258,10 @@ def create_conversational_chain(llm, db, mode):
     )
     
     # Crear prompt personalizado según el modo
-    prompt = PromptTemplate(
-        input_variables=["context", "chat_history", "question"],
-        template=PROMPTS[mode]
-    )
+    prompt = get_prompt(mode)
     
     # Crear la cadena conversacional
-    qa_chain = ConversationalRetrievalChain.from_llm(
+    qa_chain = CanonicalRetrievalChain.from_llm(
         llm=llm,
         retriever=db.as_retriever(search_kwargs={"k": RETRIEVER_K}),
         memory=memory,
@@ -165,19 +272,22 @@ def create_conversational_chain(llm, db, mode):
     
     return qa_chain
 
-def get_response(qa_chain, question):
+def get_response(qa_chain, question, usage=None):
     """
     Obtiene respuesta del chatbot
     
     Args:
         qa_chain: Cadena conversacional
         question (str): Pregunta del usuario
+        usage (PromptCacheUsage): Acumulador opcional de tokens de entrada y en caché
         
     Returns:
         str: Respuesta del chatbot
     """
+    config = {"callbacks": [usage]} if usage else None
+    
     try:
-        resultado = qa_chain.invoke({"question": question})
+        resultado = qa_chain.invoke({"question": question}, config=config)
         return resultado['answer']
     except Exception as e:
         st.error(f"❌ Error generando respuesta: {e}")
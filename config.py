@@ -5,6 +5,8 @@ Configuración y constantes del chatbot
 # URLs y configuración de servicios
 SUPABASE_URL = "https://sevobuvdlkzqcbwfhzxq.supabase.com"
 SUPABASE_TABLE = "conversaciones"
+# Columnas de métricas que pueden no existir aún en la tabla
+OPTIONAL_COLUMNS = ("tokens_entrada", "tokens_cache", "ratio_cache", "tiempo_espera")
 
 # Configuración del modelo
 MODEL_NAME = "gpt-4.1"
@@ -14,6 +16,17 @@ RETRIEVER_K = 3
 # Configuración del streaming
 STREAMING_DELAY = 0.05  # Segundos entre palabras
 
+# Configuración del procesamiento por lotes (batch.py)
+BATCH_WORKERS = 4  # Llamadas simultáneas al LLM
+BATCH_SIZE = 32  # Preguntas por lote de embeddings
+
+# Control de admisión de la aplicación web
+RATE_LIMIT_BURST = 5  # Preguntas seguidas permitidas por sesión
+RATE_LIMIT_PER_MINUTE = 6  # Ritmo sostenido de preguntas por sesión
+MAX_CONCURRENT_REQUESTS = 4  # Llamadas simultáneas al LLM en todo el proceso
+MAX_QUEUED_REQUESTS = 8  # Preguntas esperando turno antes de responder "ocupado"
+QUEUE_TIMEOUT = 30  # Segundos máximos de espera en la cola
+
 # Estilos CSS
 CSS_STYLES = """
 <style>
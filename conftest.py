@@ -0,0 +1,3 @@
+"""
+Permite importar los módulos de la raíz (chatbot, config...) desde tests/
+"""
@@ -14,10 +14,13 @@ Gestión de la base de datos Supabase
 
 import streamlit as st
 import os
+import logging
 import pandas as pd
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from config import SUPABASE_URL, SUPABASE_TABLE
+from config import SUPABASE_URL, SUPABASE_TABLE, OPTIONAL_COLUMNS
+
+logger = logging.getLogger(__name__)
 
 # Forzar carga del .env
 load_dotenv()
@@ -92,6 +95,42 @@ def save_conversation(supabase, pregunta, respuesta, modo, tiempo_respuesta, ses
             st.error(f"🔍 **Tipo de error:** {type(e).__name__}")
         return False
 
+def insert_conversation(supabase, data):
+    """
+    Insertar una conversación sin interrumpir la experiencia del usuario
+    
+    Las métricas de OPTIONAL_COLUMNS se añadieron después de crear la tabla.
+    Si la inserción falla (por ejemplo, porque aún no existen esas columnas)
+    se registra el error y se reintenta sin ellas para no perder la
+    conversación. Para guardarlas hay que crear las columnas:
+    
+        alter table conversaciones
+            add column if not exists tokens_entrada integer,
+            add column if not exists tokens_cache integer,
+            add column if not exists ratio_cache real,
+            add column if not exists tiempo_espera real;
+    
+    Args:
+        supabase (Client): Cliente de Supabase
+        data (dict): Fila a insertar
+        
+    Returns:
+        bool: True si se guardó la conversación (con o sin métricas)
+    """
+    try:
+        supabase.table(SUPABASE_TABLE).insert(data).execute()
+        return True
+    except Exception as e:
+        logger.warning("Error guardando conversación con métricas: %s", e)
+    
+    base = {key: value for key, value in data.items() if key not in OPTIONAL_COLUMNS}
+    try:
+        supabase.table(SUPABASE_TABLE).insert(base).execute()
+        return True
+    except Exception as e:
+        logger.error("Error guardando conversación: %s", e)
+        return False
+
 def get_analytics(supabase):
     """
     Obtener estadísticas de uso de la base de datos
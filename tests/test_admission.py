@@ -0,0 +1,81 @@
+"""
+Control de admisión: límite por sesión, cola acotada y semáforo global
+"""
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+import admission
+from admission import AdmissionController, ADMITIDA, LIMITADA, OCUPADO
+
+class FakeClock:
+    """Reloj manual para no depender de sleeps en los tests"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", fake)
+    return fake
+
+def test_burst_exhaustion_and_refill(clock):
+    controller = AdmissionController(max_concurrent=10, max_queued=0, burst=2, per_minute=60)
+
+    for _ in range(2):
+        assert controller.acquire("s1")[0] == ADMITIDA
+        controller.release()
+    assert controller.acquire("s1")[0] == LIMITADA
+
+    clock.now += 1  # 60 por minuto: un token por segundo
+    assert controller.acquire("s1")[0] == ADMITIDA
+    controller.release()
+    assert controller.acquire("s1")[0] == LIMITADA
+
+def test_full_queue_is_busy_without_spending_tokens(clock):
+    controller = AdmissionController(max_concurrent=1, max_queued=0, burst=1, per_minute=0)
+    assert controller.acquire("s1")[0] == ADMITIDA
+
+    for _ in range(3):
+        assert controller.acquire("s2") == (OCUPADO, 0.0)
+
+    controller.release()
+    assert controller.acquire("s2")[0] == ADMITIDA
+
+def test_queue_timeout_is_busy_and_refunds_token():
+    controller = AdmissionController(max_concurrent=1, max_queued=1, queue_timeout=0.05,
+                                     burst=1, per_minute=0)
+    assert controller.acquire("s1")[0] == ADMITIDA
+
+    resultado, tiempo_espera = controller.acquire("s2")
+    assert resultado == OCUPADO
+    assert tiempo_espera >= 0.05
+
+    controller.release()
+    assert controller.acquire("s2")[0] == ADMITIDA
+
+def test_release_returns_permit():
+    controller = AdmissionController(max_concurrent=1, max_queued=0, burst=5, per_minute=0)
+    assert controller.acquire("s1")[0] == ADMITIDA
+    assert controller.acquire("s2")[0] == OCUPADO
+
+    controller.release()
+    assert controller.acquire("s2")[0] == ADMITIDA
+
+def test_evicts_least_recently_used_bucket(monkeypatch, clock):
+    monkeypatch.setattr(admission, "MAX_TRACKED_SESSIONS", 2)
+    controller = AdmissionController(max_concurrent=10, max_queued=0, burst=1, per_minute=0)
+
+    for session_id in ("s1", "s2"):
+        controller.acquire(session_id)
+        controller.release()
+    assert controller.acquire("s1")[0] == LIMITADA  # s1 pasa a ser la más reciente
+
+    controller.acquire("s3")
+    controller.release()
+    assert list(controller._buckets) == ["s1", "s3"]
@@ -0,0 +1,45 @@
+"""
+Estabilidad del prefijo de los prompts (caché de prompts del proveedor)
+"""
+
+import hashlib
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("langchain")
+
+from langchain_core.documents import Document
+from chatbot import PROMPTS, PROMPT_PREFIXES, get_prompt, canonical_order, format_context
+
+# Huella de cada plantilla completa. Cambiar un prompt invalida la caché del
+# proveedor, así que si cambia a propósito hay que actualizar aquí el hash.
+PROMPT_HASHES = {
+    "ciudadano": "2569796f7d43770eb3be3f6369e127e96508dc68cdd285a2bfbf9ad5df564e1b",
+    "estudiante": "486fc28a506bd8ad79568692ee0d54b0a83e18916724d0cd940727bc3813e0b0",
+    "profesional": "7d218f3fe4a1a1b8444e222d0bacfab61e7bb8dcd3a4e95fbfbb4fbde0ab46ab"
+}
+
+@pytest.mark.parametrize("mode", PROMPTS)
+def test_prompt_starts_with_static_prefix(mode):
+    assert PROMPTS[mode].startswith(PROMPT_PREFIXES[mode])
+    assert "{" not in PROMPT_PREFIXES[mode]
+
+@pytest.mark.parametrize("mode", PROMPTS)
+def test_prompt_template_unchanged(mode):
+    assert hashlib.sha256(PROMPTS[mode].encode()).hexdigest() == PROMPT_HASHES[mode]
+
+@pytest.mark.parametrize("mode", PROMPTS)
+def test_prefix_stable_across_calls(mode):
+    primera = get_prompt(mode).format(
+        context="Artículo 1", chat_history="", question="¿Qué es el Estado?"
+    )
+    segunda = get_prompt(mode).format(
+        context="Artículo 20", chat_history="Human: hola\nAssistant: hola", question="¿Y la libertad?"
+    )
+    prefijo = PROMPT_PREFIXES[mode]
+    assert primera[:len(prefijo)] == segunda[:len(prefijo)] == prefijo
+
+def test_canonical_order_gives_same_context():
+    a, b, c = (Document(page_content=f"Artículo {n}") for n in (14, 20, 1))
+    assert format_context(canonical_order([a, b, c])) == format_context(canonical_order([c, a, b]))
+    assert format_context(canonical_order([b, a, b, c, a])) == format_context(canonical_order([a, b, c]))
@@ -7,8 +7,9 @@ import time
 import uuid
 
 # Importar módulos locales
-from database import init_supabase, save_conversation, get_analytics
-from chatbot import load_chatbot_components, create_conversational_chain, get_response, clear_conversation_memory
+from database import init_supabase, save_conversation, insert_conversation, get_analytics
+from admission import get_admission_controller, ADMITIDA, LIMITADA, OCUPADO
+from chatbot import load_chatbot_components, create_conversational_chain, get_response, clear_conversation_memory, PromptCacheUsage
 from config import CSS_STYLES, MODE_COLORS, MODE_NAMES, WELCOME_MESSAGES, STREAMING_DELAY
 
 # Configuración de la página
@@ -92,21 +93,40 @@ def render_chat_history():
         else:
             st.markdown(f'<div class="chat-message bot-message"><strong>🤖 Asistente:</strong> {message["content"]}</div>', unsafe_allow_html=True)
 
+def mark_question_in_flight(input_key):
+    """Marca la pregunta como en curso al pulsar Enviar (antes del rerun)"""
+    if st.session_state.get(input_key, "").strip():
+        st.session_state.pregunta_en_curso = True
+
 def render_user_input():
     """Renderiza el input del usuario y devuelve la entrada y el botón"""
+    # Aviso pendiente de la ejecución anterior (rechazo o error)
+    aviso = st.session_state.pop("aviso", None)
+    if aviso:
+        st.warning(aviso)
+    
     col1, col2 = st.columns([6, 1])
+    input_key = f"user_input_{len(st.session_state.messages)}"
     
     with col1:
         user_input = st.text_input(
             "Escribe tu pregunta:",
             placeholder="Ej: ¿Qué dice sobre la libertad de expresión?",
-            key=f"user_input_{len(st.session_state.messages)}",
+            key=input_key,
             label_visibility="visible"
         )
     
     with col2:
         st.markdown("<br>", unsafe_allow_html=True)
-        send_button = st.button("Enviar", type="primary", use_container_width=True)
+        # Deshabilitado mientras se responde: es lo que evita los envíos duplicados
+        send_button = st.button(
+            "Enviar",
+            type="primary",
+            use_container_width=True,
+            disabled=st.session_state.get("pregunta_en_curso", False),
+            on_click=mark_question_in_flight,
+            args=(input_key,)
+        )
     
     return user_input, send_button
 
@@ -129,45 +149,72 @@ def simulate_streaming_response(response_container, respuesta_completa):
         unsafe_allow_html=True
     )
 
-def process_user_question(user_input, send_button, qa_chain, supabase):
+def process_user_question(user_input, send_button, qa_chain, supabase, admission):
     """Procesa la pregunta del usuario"""
     if send_button and user_input.strip():
-        # Añadir pregunta al historial
-        st.session_state.messages.append({"role": "user", "content": user_input})
-        
         try:
-            # Medir tiempo de respuesta
-            start_time = time.time()
-            
-            # Obtener respuesta del chatbot
-            with st.spinner("Consultando la Constitución..."):
-                respuesta_completa = get_response(qa_chain, user_input)
-            
-            # Calcular tiempo de respuesta
-            tiempo_respuesta = time.time() - start_time
-            
-            # Añadir respuesta al historial
-            st.session_state.messages.append({"role": "assistant", "content": respuesta_completa})
-            
-            # Guardar en base de datos (sin bloquear la UI)
-            if supabase:
-                try:
-                    data = {
-                        "pregunta": user_input,
-                        "respuesta": respuesta_completa,
-                        "modo": st.session_state.mode,
-                        "tiempo_respuesta": tiempo_respuesta,
-                        "session_id": st.session_state.session_id
-                    }
-                    supabase.table("conversaciones").insert(data).execute()
-                except:
-                    pass  # Fallar silenciosamente para no interrumpir la experiencia
-            
-            # Rerun para mostrar todo
-            st.rerun()
-            
-        except Exception as e:
-            st.error(f"❌ Error procesando pregunta: {e}")
+            answer_user_question(user_input, qa_chain, supabase, admission)
+        finally:
+            # Se libera también si un rerun interrumpe la respuesta
+            st.session_state.pregunta_en_curso = False
+
+def answer_user_question(user_input, qa_chain, supabase, admission):
+    """Pide turno, obtiene la respuesta y la guarda"""
+    session_id = st.session_state.session_id
+    
+    # Pedir turno antes de consultar al LLM. Entre acquire y el try/finally
+    # no puede haber llamadas a st.*: un rerun en ese punto perdería el turno
+    resultado, tiempo_espera = admission.acquire(session_id)
+    
+    if resultado != ADMITIDA:
+        st.session_state.aviso = {
+            LIMITADA: "⚠️ Has enviado demasiadas preguntas seguidas. Espera unos segundos antes de volver a intentarlo.",
+            OCUPADO: "🚦 El asistente está muy ocupado en este momento. Inténtalo de nuevo en unos instantes."
+        }[resultado]
+        st.session_state.pregunta_en_curso = False
+        st.rerun()
+    
+    try:
+        # Medir tiempo de respuesta (sin contar la espera en cola)
+        start_time = time.time()
+        
+        # Obtener respuesta del chatbot (y uso de la caché de prompts)
+        usage = PromptCacheUsage()
+        with st.spinner("Consultando la Constitución..."):
+            respuesta_completa = get_response(qa_chain, user_input, usage)
+    except Exception as e:
+        # Rerun para volver a mostrar el botón habilitado junto al error
+        st.session_state.aviso = f"❌ Error procesando pregunta: {e}"
+        st.session_state.pregunta_en_curso = False
+        st.rerun()
+    finally:
+        admission.release()
+    
+    # Calcular tiempo de respuesta
+    tiempo_respuesta = time.time() - start_time
+    
+    # Añadir pregunta y respuesta al historial
+    st.session_state.messages.append({"role": "user", "content": user_input})
+    st.session_state.messages.append({"role": "assistant", "content": respuesta_completa})
+    
+    # Guardar en base de datos (sin bloquear la UI)
+    if supabase:
+        data = {
+            "pregunta": user_input,
+            "respuesta": respuesta_completa,
+            "modo": st.session_state.mode,
+            "tiempo_respuesta": tiempo_respuesta,
+            "tiempo_espera": tiempo_espera,
+            "session_id": session_id,
+            "tokens_entrada": usage.input_tokens,
+            "tokens_cache": usage.cached_tokens,
+            "ratio_cache": round(usage.cached_ratio, 3)
+        }
+        insert_conversation(supabase, data)
+    
+    # Liberar el botón antes del rerun para mostrarlo ya habilitado
+    st.session_state.pregunta_en_curso = False
+    st.rerun()
 
 def render_sidebar(supabase):
     """Renderiza la barra lateral con información y analytics"""
@@ -258,10 +305,11 @@ def main():
     render_chat_history()
     
     # Renderizar input del usuario
+    admission = get_admission_controller()
     user_input, send_button = render_user_input()
     
     # Procesar pregunta del usuario
-    process_user_question(user_input, send_button, st.session_state.qa_chain, supabase)
+    process_user_question(user_input, send_button, st.session_state.qa_chain, supabase, admission)
     
     # Renderizar sidebar
     render_sidebar(supabase)